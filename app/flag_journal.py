@@ -0,0 +1,186 @@
+import threading
+import time
+import csv
+import os
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+JOURNAL_SUFFIX = '.journal'
+
+def lock_journal(file):
+    """ Take a non-blocking exclusive lock on an open journal; False if another process holds it.
+
+    The lock belongs to the open file, so it is released if Recapp crashes and the journal becomes replayable.
+    """
+    try:
+        if fcntl is not None:
+            fcntl.flock(file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            file.seek(0)
+            msvcrt.locking(file.fileno(), msvcrt.LK_NBLCK, 1)
+    except OSError:
+        return False
+    return True
+
+def remove_locked_journal(file, journal_path):
+    # Remove before closing where possible, so the lock covers the whole compaction;
+    # Windows can't delete an open file, so there it has to be closed first
+    if fcntl is not None:
+        os.remove(journal_path)
+        file.close()
+    else:
+        file.close()
+        os.remove(journal_path)
+
+def load_flagged_event_keys(csv_filename):
+    """ Return the (participant, condition, event, question time, answer time) of every row already in the CSV. """
+    if not os.path.isfile(csv_filename):
+        return set()
+    with open(csv_filename, 'r', newline='') as file:
+        return {tuple(row[:5]) for row in csv.reader(file) if len(row) >= 5}
+
+def append_flagged_events(csv_filename, participant_id, condition, question_times, answer_times, existing=frozenset()):
+    """ Append every complete question/answer pair not already in existing to the flagged events CSV and fsync it. """
+    with open(csv_filename, 'a', newline='') as file:
+        writer = csv.writer(file)
+        for event_id in sorted(set(question_times.keys()).union(answer_times.keys())):
+            question_time = question_times.get(event_id, '')
+            answer_time = answer_times.get(event_id, '')
+            if question_time and answer_time:
+                if (participant_id, condition, f"E{event_id}", question_time, answer_time) in existing:
+                    continue
+                time_difference = f"{float(answer_time) - float(question_time):.2f}"
+                writer.writerow([participant_id, condition, f"E{event_id}", question_time, answer_time, time_difference])
+        file.flush()
+        os.fsync(file.fileno())
+
+def read_journal(journal_path):
+    """ Return (participant_id, condition, question_times, answer_times) recorded in a journal file. """
+    participant_id = condition = None
+    question_times = {}
+    answer_times = {}
+    with open(journal_path, 'r', newline='') as file:
+        for line in file:
+            # A crash can leave the last record half-written; anything without a newline is ignored
+            if not line.endswith('\n'):
+                break
+            row = next(csv.reader([line]))
+            if len(row) != 3:
+                continue
+            kind, first, second = row
+            if kind == 'session':
+                participant_id, condition = first, second
+            elif kind == 'question':
+                question_times[int(first)] = second
+            elif kind == 'answer':
+                answer_times[int(first)] = second
+    return participant_id, condition, question_times, answer_times
+
+def compact_journal(journal_path, csv_filename, existing=frozenset()):
+    """ Move the pairs recorded in a journal into the flagged events CSV. The caller must hold the journal's lock. """
+    participant_id, condition, question_times, answer_times = read_journal(journal_path)
+    if participant_id is not None:
+        append_flagged_events(csv_filename, participant_id, condition, question_times, answer_times, existing)
+
+def replay_journals(journal_directory, csv_filename):
+    """ Compact journals left behind by sessions that never reached stop_recording. """
+    if not os.path.isdir(journal_directory):
+        return 0
+    journals = sorted((entry for entry in os.scandir(journal_directory) if entry.name.endswith(JOURNAL_SUFFIX)),
+                      key=lambda entry: entry.name)
+    if not journals:
+        return 0
+    # A crash between appending to the CSV and removing the journal leaves pairs that are already
+    # in the CSV, so replay skips rows that are present to keep compaction idempotent
+    existing = load_flagged_event_keys(csv_filename)
+    replayed = 0
+    for entry in journals:
+        try:
+            file = open(entry.path, 'r')
+        except FileNotFoundError:
+            continue  # Compacted by its own session in the meantime
+        try:
+            # A locked journal belongs to a session that is still recording (here or on another station)
+            if not lock_journal(file):
+                file.close()
+                continue
+            # If its session compacted and removed it between our open and lock, this is a stale inode
+            if not os.path.exists(entry.path) or os.stat(entry.path).st_ino != os.fstat(file.fileno()).st_ino:
+                file.close()
+                continue
+            compact_journal(entry.path, csv_filename, existing)
+            remove_locked_journal(file, entry.path)
+            replayed += 1
+            print(f"Recovered flagged events from unfinished session journal {entry.name}")
+        except Exception as e:
+            file.close()
+            print(f"Error replaying journal {entry.name}: {e}")
+    return replayed
+
+class FlagJournal:
+    """ Per-session append-only log of flags, made durable by a background group-commit fsync. """
+
+    def __init__(self, journal_directory, participant_id, condition, commit_interval=0.2):
+        os.makedirs(journal_directory, exist_ok=True)
+        self.path = os.path.join(journal_directory, f"flags_{participant_id}_C{condition}_{int(time.time() * 1000)}{JOURNAL_SUFFIX}")
+        self.commit_interval = commit_interval
+        # Lock under a temporary name and only then give it the .journal suffix, so replay in another
+        # Recapp never sees this journal unlocked
+        temp_path = f"{self.path}.new"
+        self.file = open(temp_path, 'a', newline='')
+        if not lock_journal(self.file):
+            self.file.close()
+            raise OSError(f"Could not lock journal {temp_path}")
+        os.replace(temp_path, self.path)
+        self.writer = csv.writer(self.file, lineterminator='\n')
+        self.lock = threading.Lock()
+        self.pending = threading.Event()
+        self.closed = False
+
+        self.writer.writerow(['session', participant_id, condition])
+        self.pending.set()
+
+        self.flusher = threading.Thread(target=self.flush_loop, daemon=True)
+        self.flusher.start()
+
+    def append(self, kind, event_id, timestamp):
+        # Only a buffered write on the caller's thread; the fsync happens in the flusher
+        with self.lock:
+            self.writer.writerow([kind, event_id, timestamp])
+        self.pending.set()
+
+    def flush_loop(self):
+        while not self.closed:
+            self.pending.wait()
+            # Give closely spaced flags a moment to share the same fsync
+            time.sleep(self.commit_interval)
+            self.pending.clear()
+            self.commit()
+
+    def commit(self):
+        # Only the flush needs the lock; appends from the keypress thread must not wait on the fsync.
+        # commit() runs on the flusher, or in close() after the flusher has stopped, so the fd stays open.
+        with self.lock:
+            if self.file.closed:
+                return
+            self.file.flush()
+            fd = self.file.fileno()
+        os.fsync(fd)
+
+    def close(self):
+        """ Stop the flusher and make everything written so far durable; the journal stays locked. """
+        self.closed = True
+        self.pending.set()
+        self.flusher.join()
+        self.commit()
+
+    def compact(self, csv_filename):
+        """ Close the journal, fold it into the flagged events CSV and remove it, holding the lock throughout. """
+        self.close()
+        compact_journal(self.path, csv_filename)
+        with self.lock:
+            remove_locked_journal(self.file, self.path)
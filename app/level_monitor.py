@@ -0,0 +1,98 @@
+import numpy as np
+import tkinter as tk
+
+class LevelRingBuffer:
+    """ Fixed-size ring of per-block (min, max, rms) summaries, written from the audio callback. """
+
+    def __init__(self, capacity=400, full_scale=32768.0, max_block_frames=8192):
+        self.capacity = capacity
+        self.full_scale = full_scale
+        self.summaries = np.zeros((capacity, 3), dtype=np.float32)
+        # Scratch space for the squared samples, so push() doesn't allocate arrays on the audio thread
+        self.squares = np.zeros(max_block_frames, dtype=np.float32)
+        self.write_count = 0
+
+    def reset(self):
+        self.summaries.fill(0)
+        self.write_count = 0
+
+    def push(self, block, channel=0):
+        # Reductions run on the int16 column view in place; never loops over samples in Python
+        samples = block[:, channel]
+        frames = len(samples)
+        if frames == 0:
+            return
+        if frames > len(self.squares):
+            # Only happens if the host hands over a larger block than any before it
+            self.squares = np.zeros(frames, dtype=np.float32)
+        squares = self.squares[:frames]
+        np.square(samples, out=squares, dtype=np.float32)
+
+        row = self.summaries[self.write_count % self.capacity]
+        row[0] = samples.min() / self.full_scale
+        row[1] = samples.max() / self.full_scale
+        row[2] = np.sqrt(squares.sum() / frames) / self.full_scale
+        # Publish the slot only after it has been filled so the reader never sees a half-written row
+        self.write_count += 1
+
+    def snapshot(self):
+        """ Return (write_count, summaries oldest-first) for the blocks written so far. """
+        write_count = self.write_count
+        filled = min(write_count, self.capacity)
+        start = write_count % self.capacity
+        if filled < self.capacity:
+            return write_count, self.summaries[:filled].copy()
+        return write_count, np.roll(self.summaries, -start, axis=0)
+
+class LevelMonitor:
+    """ Scrolling min/max waveform strip with an RMS level readout, redrawn from a LevelRingBuffer. """
+
+    def __init__(self, parent, levels, width=400, height=80, max_fps=20):
+        self.levels = levels
+        self.width = width
+        self.height = height
+        self.redraw_interval = int(1000 / max_fps)
+        self.last_drawn = -1
+
+        self.canvas = tk.Canvas(parent, width=width, height=height, bg='black', highlightthickness=0)
+        self.canvas.pack(pady=(5, 5))
+        self.level_label = tk.Label(parent, text="Level: -inf dBFS")
+        self.level_label.pack(pady=(0, 10))
+
+        # Items are created once and only have their coordinates updated, so redraw cost stays flat
+        middle = height / 2
+        self.centre_line = self.canvas.create_line(0, middle, width, middle, fill='gray30')
+        self.envelope = self.canvas.create_polygon(0, middle, 0, middle, 0, middle, fill='green3', outline='')
+        self.rms_line = self.canvas.create_line(0, middle, 0, middle, fill='yellow')
+
+        self.canvas.after(self.redraw_interval, self.redraw)
+
+    def redraw(self):
+        write_count, summaries = self.levels.snapshot()
+        if write_count != self.last_drawn:
+            self.last_drawn = write_count
+            self.draw(summaries)
+        self.canvas.after(self.redraw_interval, self.redraw)
+
+    def draw(self, summaries):
+        middle = self.height / 2
+        if len(summaries) < 2:
+            self.canvas.coords(self.envelope, 0, middle, 0, middle, 0, middle)
+            self.canvas.coords(self.rms_line, 0, middle, 0, middle)
+            self.level_label.config(text="Level: -inf dBFS")
+            return
+
+        # Newest block sits at the right edge; one canvas column per block
+        x = np.arange(self.width - len(summaries), self.width, dtype=np.float32)
+        top = middle - np.clip(summaries[:, 1], -1, 1) * middle
+        bottom = middle - np.clip(summaries[:, 0], -1, 1) * middle
+        rms = middle - np.clip(summaries[:, 2], 0, 1) * middle
+
+        upper = np.column_stack((x, top)).ravel()
+        lower = np.column_stack((x[::-1], bottom[::-1])).ravel()
+        self.canvas.coords(self.envelope, *np.concatenate((upper, lower)).tolist())
+        self.canvas.coords(self.rms_line, *np.column_stack((x, rms)).ravel().tolist())
+
+        latest_rms = summaries[-1, 2]
+        level_db = 20 * np.log10(latest_rms) if latest_rms > 0 else float('-inf')
+        self.level_label.config(text=f"Level: {level_db:.1f} dBFS")
@@ -5,8 +5,16 @@ import tkinter as tk
 import time
 import csv
 import os
+import sys
 from PIL import Image, ImageTk
 
+# Add the parent directory to the system path to ensure module imports work correctly
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from scripts.catalog import CATALOG_FILENAME, register_recording
+from scripts.callback_stats import CallbackStats, save_callback_summary
+from app.level_monitor import LevelMonitor, LevelRingBuffer
+from app.flag_journal import FlagJournal, replay_journals
+
 class AudioRecorderApp:
     def __init__(self, root):
         self.root = root
@@ -40,6 +48,14 @@ class AudioRecorderApp:
         self.csv_filename = os.path.join(self.data_directory, 'flagged_events.csv')
         self.ensure_csv_file_exists()
 
+        # Flags are journalled as they happen; recover any session that crashed before it was saved
+        self.journal_directory = os.path.join(self.data_directory, 'journal')
+        self.journal = None
+        replay_journals(self.journal_directory, self.csv_filename)
+
+        # Recording catalog used by Wavstomp to find sessions without walking the participants directory
+        self.catalog_filename = os.path.join(self.data_directory, CATALOG_FILENAME)
+
         # Input validation
         validate_numeric_command = root.register(self.validate_numeric_input)
         validate_letter_command = root.register(self.validate_letter_condition)
@@ -61,6 +77,11 @@ class AudioRecorderApp:
         self.condition_entry = tk.Entry(self.content_frame, validate="key", validatecommand=(validate_letter_command, '%S'))
         self.condition_entry.pack(pady=(0, 20))
 
+        # Optional second input channel for the interviewer: a second mic or a loopback of question playback
+        self.dual_channel_var = tk.BooleanVar(value=False)
+        self.dual_channel_check = tk.Checkbutton(self.content_frame, text="Record interviewer on channel 2", variable=self.dual_channel_var)
+        self.dual_channel_check.pack(pady=(0, 10))
+
         self.start_button = tk.Button(self.content_frame, text="Start Recording", command=self.start_recording)
         self.start_button.pack(pady=(10, 5))
 
@@ -79,6 +100,10 @@ class AudioRecorderApp:
         self.recording_time_label = tk.Label(self.content_frame, text="Recording Time: 00:00")
         self.recording_time_label.pack(pady=(5, 10))
 
+        # Live input level strip, fed with per-block summaries from the audio callback
+        self.levels = LevelRingBuffer()
+        self.level_monitor = LevelMonitor(self.content_frame, self.levels)
+
         self.event_id_label = tk.Label(self.content_frame, text="Last Completed Event ID (e.g., E1 = 1):")
         self.event_id_label.pack(pady=(10, 5))
 
@@ -91,7 +116,14 @@ class AudioRecorderApp:
         # Audio parameters
         self.sample_rate = 44100
         self.channels = 1
+        # Wavstomp looks for answers on the participant channel only; the interviewer is channel index 1
+        self.participant_channel = 0
         self.dtype = np.int16
+        # Stream tuning: blocksize=0 lets the host pick a variable block size; see the
+        # *_callback_stats.json summary saved with each recording when adjusting these
+        self.blocksize = 0
+        self.latency = 'high'
+        self.callback_stats = CallbackStats(direction='input', sample_rate=self.sample_rate)
 
         self.update_clock()
 
@@ -137,9 +169,44 @@ class AudioRecorderApp:
             self.create_participant_directory()
             self.load_last_event_id()
 
+        channels = 2 if self.dual_channel_var.get() else 1
+        try:
+            max_input_channels = sd.query_devices(kind='input')['max_input_channels']
+        except Exception as e:
+            print(f"Error querying the input device: {e}")
+            return
+        if channels > max_input_channels:
+            print(f"The input device has {max_input_channels} channel(s); untick the interviewer channel or choose a two-channel device.")
+            return
+
+        # Open the stream before touching any session state, so a device error leaves the app idle
+        self.levels.reset()
+        self.callback_stats.reset()
+        try:
+            stream = sd.InputStream(
+                channels=channels,
+                samplerate=self.sample_rate,
+                dtype=self.dtype,
+                blocksize=self.blocksize,
+                latency=self.latency,
+                callback=self.audio_callback
+            )
+            stream.start()
+        except Exception as e:
+            print(f"Error opening the audio input stream: {e}")
+            return
+        self.stream = stream
+        self.channels = channels
+
+        # Each recording has its own timebase, so a question left unanswered by the previous one can't be paired
+        if self.last_flagged == 'question':
+            self.question_times.pop(self.event_id, None)
+        self.last_flagged = None
+
         self.recording = True
         self.start_time = time.time()
         self.recorded_chunks = []
+        self.journal = FlagJournal(self.journal_directory, self.participant_id, self.condition)
         self.status_label.config(text="Status: Recording...")
         self.start_button.config(state=tk.DISABLED)
         self.stop_button.config(state=tk.NORMAL)
@@ -148,14 +215,7 @@ class AudioRecorderApp:
 
         self.participant_id_entry.config(state=tk.DISABLED)
         self.condition_entry.config(state=tk.DISABLED)
-
-        self.stream = sd.InputStream(
-            channels=self.channels,
-            samplerate=self.sample_rate,
-            dtype=self.dtype,
-            callback=self.audio_callback
-        )
-        self.stream.start()
+        self.dual_channel_check.config(state=tk.DISABLED)
 
     def stop_recording(self):
         if self.recording:
@@ -168,6 +228,7 @@ class AudioRecorderApp:
 
             self.participant_id_entry.config(state=tk.NORMAL)
             self.condition_entry.config(state=tk.NORMAL)
+            self.dual_channel_check.config(state=tk.NORMAL)
 
             self.stream.stop()
             self.stream.close()
@@ -184,18 +245,45 @@ class AudioRecorderApp:
                 print(f"Recording saved as {filepath}")
             except Exception as e:
                 print(f"Error saving recording: {e}")
+            else:
+                self.register_recording(filepath)
+                self.save_callback_stats(filepath)
 
             # Save the flagged events in the specified format
             self.save_flagged_events()
 
+    def register_recording(self, filepath):
+        try:
+            frame_bytes = self.channels * (np.iinfo(self.dtype).bits // 8)
+            duration = sum(len(chunk) for chunk in self.recorded_chunks) / frame_bytes / self.sample_rate
+            register_recording(self.catalog_filename, self.main_directory, filepath, self.participant_id, self.condition,
+                               duration, self.sample_rate, self.channels, os.path.getsize(filepath))
+        except Exception as e:
+            print(f"Error registering recording in catalog: {e}")
+
+    def save_callback_stats(self, filepath):
+        stats_file = f"{os.path.splitext(filepath)[0]}_callback_stats.json"
+        try:
+            sections = {'input': self.callback_stats.summary(blocksize=self.blocksize, latency=self.latency)}
+            save_callback_summary(stats_file, **sections)
+            flags = {flag: count for flag, count in self.callback_stats.flag_counts.items() if count}
+            if flags:
+                print(f"Warning: audio stream reported {flags} during this recording")
+        except Exception as e:
+            print(f"Error saving callback stats: {e}")
+
     def audio_callback(self, indata, frames, time, status):
+        started = self.callback_stats.start()
         if self.recording:
             self.recorded_chunks.append(indata.tobytes())
+            self.levels.push(indata, self.participant_channel)
+        self.callback_stats.record(started, frames, status, time)
 
     def flag_question(self):
         if self.recording and self.last_flagged != 'question':
             elapsed_time = time.time() - self.start_time
             self.question_times[self.event_id] = f"{elapsed_time:.2f}"
+            self.journal.append('question', self.event_id, self.question_times[self.event_id])
             print(f"Question flagged at {elapsed_time:.2f} seconds (Event ID: E{self.event_id})")
             self.last_flagged = 'question'
             self.flag_question_button.config(state=tk.DISABLED)
@@ -205,6 +293,7 @@ class AudioRecorderApp:
         if self.recording and self.last_flagged != 'answer':
             elapsed_time = time.time() - self.start_time
             self.answer_times[self.event_id] = f"{elapsed_time:.2f}"
+            self.journal.append('answer', self.event_id, self.answer_times[self.event_id])
             print(f"Answer flagged at {elapsed_time:.2f} seconds (Event ID: E{self.event_id})")
             self.event_id += 1
             self.last_flagged = 'answer'
@@ -213,18 +302,10 @@ class AudioRecorderApp:
 
     def save_flagged_events(self):
         try:
-            with open(self.csv_filename, 'a', newline='') as file:
-                writer = csv.writer(file)
-                for event_id in sorted(set(self.question_times.keys()).union(self.answer_times.keys())):
-                    question_time = self.question_times.get(event_id, '')
-                    answer_time = self.answer_times.get(event_id, '')
-                    if question_time and answer_time:
-                        question_time_float = float(question_time)
-                        answer_time_float = float(answer_time)
-                        time_difference = f"{answer_time_float - question_time_float:.2f}"
-                        writer.writerow([self.participant_id, self.condition, f"E{event_id}", question_time, answer_time, time_difference])
+            self.journal.compact(self.csv_filename)
         except Exception as e:
-            print(f"Error saving flagged events: {e}")
+            print(f"Error saving flagged events (journal kept at {self.journal.path}): {e}")
+        self.journal = None
 
     def flag_question_key(self, event):
         self.flag_question()
@@ -0,0 +1,24 @@
+from contextlib import contextmanager
+import tempfile
+import os
+
+@contextmanager
+def atomic_write(path, mode='w', newline=None):
+    """ Open a temp file next to path and move it over path only once it has been written in full.
+
+    Readers see either the old file or the complete new one, never a partial write.
+    """
+    # A unique temp name lets two workers that both ended up with the same recording write safely
+    handle, temp_path = tempfile.mkstemp(suffix='.tmp', dir=os.path.dirname(path) or '.')
+    try:
+        with os.fdopen(handle, mode, newline=newline) as file:
+            yield file
+            file.flush()
+            os.fsync(file.fileno())
+        # mkstemp creates the file owner-only; other users on a shared filesystem need to read it
+        os.chmod(temp_path, 0o644)
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
@@ -2,15 +2,27 @@ import sounddevice as sd
 import numpy as np
 import wave
 import os
+import sys
+
+# Add the parent directory to the system path to ensure module imports work correctly
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from scripts.callback_stats import CallbackStats
 
 class AudioPlayer:
-    def __init__(self, filename, end_tone_frequency=500, end_tone_duration=0.5, volume=0.4, tone_file="end_tone.wav"):
+    def __init__(self, filename, end_tone_frequency=500, end_tone_duration=0.5, volume=0.4, tone_file="end_tone.wav",
+                 blocksize=4096, latency=None, stats=None):
         self.filename = filename
         self.end_tone_frequency = end_tone_frequency
         self.end_tone_duration = end_tone_duration
         self.volume = volume
         self.tone_file = tone_file
 
+        # Stream tuning; latency=None keeps the sounddevice default
+        self.blocksize = blocksize
+        self.latency = latency
+        # Pass a shared CallbackStats to accumulate playback health across several players
+        self.stats = stats if stats is not None else CallbackStats(direction='output')
+
         # Generate and save the tone if it doesn't already exist
         if not os.path.exists(self.tone_file):
             self.save_end_tone(self.tone_file)
@@ -22,18 +34,22 @@ class AudioPlayer:
             dtype = np.int16
 
             def callback(outdata, frames, time, status):
+                started = self.stats.start()
                 data = wf.readframes(frames)
                 outdata.fill(0)  # Fill the output buffer with silence (zeros)
                 
                 # Copy the data into the output buffer
                 data_np = np.frombuffer(data, dtype=dtype)
                 outdata[:len(data_np)] = data_np.reshape(-1, channels)
-                
+                self.stats.record(started, frames, status, time)
+
                 # Stop the stream if there is no more data
                 if len(data) < frames * channels * np.dtype(dtype).itemsize:
                     raise sd.CallbackStop
 
-            with sd.OutputStream(channels=channels, samplerate=sample_rate, callback=callback, dtype=dtype, blocksize=4096):
+            self.stats.sample_rate = sample_rate
+            with sd.OutputStream(channels=channels, samplerate=sample_rate, callback=callback, dtype=dtype,
+                                 blocksize=self.blocksize, latency=self.latency):
                 sd.sleep(int(wf.getnframes() / sample_rate * 1000))
         
         # Play the pre-saved end-of-question tone
@@ -61,13 +77,17 @@ class AudioPlayer:
             dtype = np.int16
 
             def callback(outdata, frames, time, status):
+                started = self.stats.start()
                 data = wf.readframes(frames)
                 outdata.fill(0)
                 data_np = np.frombuffer(data, dtype=dtype)
                 outdata[:len(data_np)] = data_np.reshape(-1, channels)
+                self.stats.record(started, frames, status, time)
                 if len(data) < frames * channels * np.dtype(dtype).itemsize:
                     raise sd.CallbackStop
 
-            with sd.OutputStream(channels=channels, samplerate=sample_rate, callback=callback, dtype=dtype, blocksize=4096):
+            self.stats.sample_rate = sample_rate
+            with sd.OutputStream(channels=channels, samplerate=sample_rate, callback=callback, dtype=dtype,
+                                 blocksize=self.blocksize, latency=self.latency):
                 sd.sleep(int(wf.getnframes() / sample_rate * 1000))
         print("End-of-question tone playback complete.")
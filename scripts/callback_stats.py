@@ -0,0 +1,109 @@
+import numpy as np
+import json
+import time
+
+STATUS_FLAGS = ('input_underflow', 'input_overflow', 'output_underflow', 'output_overflow', 'priming_output')
+
+class CallbackStats:
+    """ Real-time safe counters for a sounddevice stream callback.
+
+    Everything is preallocated up front so that recording a callback only updates
+    numbers in place; summaries are computed later, outside the audio thread.
+    """
+
+    def __init__(self, direction='input', sample_rate=44100, histogram_bins=24):
+        self.direction = direction
+        self.sample_rate = sample_rate
+        # Histogram bin i counts callbacks that took [2**(i-1), 2**i) microseconds
+        self.histogram = np.zeros(histogram_bins, dtype=np.int64)
+        self.reset()
+
+    def reset(self):
+        self.histogram.fill(0)
+        self.flag_counts = dict.fromkeys(STATUS_FLAGS, 0)
+        self.callbacks = 0
+        self.frames = 0
+        self.min_frames = 0
+        self.max_frames = 0
+        self.late_callbacks = 0
+        # Running totals cover the whole session, however long it is
+        self.duration_sum = 0.0
+        self.duration_max = 0.0
+        self.latency_count = 0
+        self.latency_sum = 0.0
+        self.latency_max = 0.0
+
+    def start(self):
+        return time.perf_counter()
+
+    def record(self, started, frames, status=None, time_info=None):
+        duration = time.perf_counter() - started
+        self.histogram[min(int(duration * 1e6).bit_length(), len(self.histogram) - 1)] += 1
+        self.duration_sum += duration
+        if duration > self.duration_max:
+            self.duration_max = duration
+
+        if time_info is not None:
+            # How far the hardware buffer is from "now": input waits on the ADC, output runs ahead of the DAC
+            if self.direction == 'input':
+                latency = time_info.currentTime - time_info.inputBufferAdcTime
+            else:
+                latency = time_info.outputBufferDacTime - time_info.currentTime
+            self.latency_count += 1
+            self.latency_sum += latency
+            if latency > self.latency_max:
+                self.latency_max = latency
+
+        if status:
+            for flag in STATUS_FLAGS:
+                if getattr(status, flag, False):
+                    self.flag_counts[flag] += 1
+
+        # A callback that takes longer than the audio it handles will eventually cause an xrun
+        if frames and duration * self.sample_rate > frames:
+            self.late_callbacks += 1
+
+        if self.callbacks == 0 or frames < self.min_frames:
+            self.min_frames = frames
+        if frames > self.max_frames:
+            self.max_frames = frames
+        self.frames += frames
+        self.callbacks += 1
+
+    def histogram_percentile(self, percent):
+        """ Upper edge, in milliseconds, of the histogram bin holding the given percentile of callbacks. """
+        rank = np.searchsorted(np.cumsum(self.histogram), self.callbacks * percent / 100)
+        return float(2 ** int(rank)) / 1000
+
+    def summary(self, **settings):
+        summary = {
+            'direction': self.direction,
+            'sample_rate': self.sample_rate,
+            'settings': settings,
+            'callbacks': self.callbacks,
+            'frames': self.frames,
+            'block_frames_min': self.min_frames,
+            'block_frames_max': self.max_frames,
+            'status_flags': dict(self.flag_counts),
+            'late_callbacks': self.late_callbacks,
+            'duration_histogram_us': {f'<{2 ** i}': int(count) for i, count in enumerate(self.histogram) if count},
+        }
+        if self.callbacks:
+            # Percentiles are bin upper bounds from the session-wide histogram, so they are at most 2x coarse
+            summary['duration_ms'] = {
+                'mean': self.duration_sum / self.callbacks * 1000,
+                'p50_upper_bound': self.histogram_percentile(50),
+                'p99_upper_bound': self.histogram_percentile(99),
+                'max': self.duration_max * 1000,
+            }
+        if self.latency_count:
+            summary['buffer_latency_ms'] = {
+                'mean': self.latency_sum / self.latency_count * 1000,
+                'max': self.latency_max * 1000,
+            }
+        return summary
+
+def save_callback_summary(file_path, **sections):
+    """ Write one or more stream summaries (e.g. input=..., output=...) to a JSON file. """
+    with open(file_path, 'w') as file:
+        json.dump(sections, file, indent=2)
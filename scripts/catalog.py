@@ -0,0 +1,156 @@
+import sqlite3
+import wave
+import time
+import os
+import re
+
+CATALOG_FILENAME = 'recordings.db'
+
+# Recapp names recordings as recording_<participant>_C<condition>_<timestamp>.wav
+RECORDING_NAME_PATTERN = re.compile(r'^recording_(?P<participant_id>[^_]+)_C(?P<condition>[^_]+)_(?P<timestamp>\d+)\.wav$')
+
+UPSERT_RECORDING = (
+    'INSERT OR REPLACE INTO recordings '
+    '(path, participant_id, condition, duration, sample_rate, channels, size, registered_at) '
+    'VALUES (?, ?, ?, ?, ?, ?, ?, ?)'
+)
+
+def parse_recording_filename(filename):
+    """ Return (participant_id, condition) for a Recapp file name, or (None, None) if it doesn't match. """
+    match = RECORDING_NAME_PATTERN.match(os.path.basename(filename))
+    if match is None:
+        return None, None
+    return match.group('participant_id'), match.group('condition')
+
+def relative_recording_path(main_directory, file_path):
+    """ Catalog key for a recording: its path under the participants directory, with '/' separators,
+    so the recording station and the analysis host agree on it whatever their mount points. """
+    return os.path.relpath(os.path.abspath(file_path), os.path.abspath(main_directory)).replace(os.sep, '/')
+
+def resolve_recording_path(main_directory, relative_path):
+    return os.path.join(os.path.abspath(main_directory), *relative_path.split('/'))
+
+def open_catalog(catalog_path):
+    """ Open the recording catalog, creating the database and table if needed. """
+    catalog_directory = os.path.dirname(catalog_path)
+    if catalog_directory:
+        os.makedirs(catalog_directory, exist_ok=True)
+    # Default rollback journal: WAL needs shared memory and doesn't work when the catalog sits on
+    # network storage shared by the recording station and the analysis host
+    connection = sqlite3.connect(catalog_path, timeout=30)
+    connection.execute(
+        'CREATE TABLE IF NOT EXISTS recordings ('
+        ' path TEXT PRIMARY KEY,'
+        ' participant_id TEXT NOT NULL,'
+        ' condition TEXT NOT NULL,'
+        ' duration REAL,'
+        ' sample_rate INTEGER,'
+        ' channels INTEGER,'
+        ' size INTEGER,'
+        ' registered_at REAL)'
+    )
+    connection.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+    return connection
+
+def register_recording(catalog_path, main_directory, file_path, participant_id, condition, duration, sample_rate, channels, size):
+    """ Add (or refresh) a single recording in the catalog. """
+    connection = open_catalog(catalog_path)
+    try:
+        with connection:
+            connection.execute(
+                UPSERT_RECORDING,
+                (relative_recording_path(main_directory, file_path), participant_id, condition, duration, sample_rate, channels, size, time.time())
+            )
+    finally:
+        connection.close()
+
+def list_recordings(catalog_path, main_directory):
+    """ Return every catalogued recording as a dict, ordered by participant, condition and path.
+
+    'relative_path' is the catalog key; 'path' is that recording resolved under main_directory on this host.
+    """
+    connection = open_catalog(catalog_path)
+    connection.row_factory = sqlite3.Row
+    try:
+        rows = connection.execute(
+            'SELECT path, participant_id, condition, duration, sample_rate, channels, size '
+            'FROM recordings ORDER BY participant_id, condition, path'
+        ).fetchall()
+    finally:
+        connection.close()
+    recordings = []
+    for row in rows:
+        recording = dict(row)
+        recording['relative_path'] = recording['path']
+        recording['path'] = resolve_recording_path(main_directory, recording['relative_path'])
+        recordings.append(recording)
+    return recordings
+
+def is_catalog_scanned(catalog_path):
+    """ True once reconcile_catalog has scanned the filesystem into this catalog at least once. """
+    if not os.path.exists(catalog_path):
+        return False
+    connection = open_catalog(catalog_path)
+    try:
+        row = connection.execute("SELECT value FROM meta WHERE key = 'scanned_at'").fetchone()
+    finally:
+        connection.close()
+    return row is not None
+
+def scan_wav_files(directory):
+    """ Yield (path, size) for every .wav under directory using os.scandir. """
+    try:
+        entries = os.scandir(directory)
+    except OSError as e:
+        print(f"Error scanning {directory}: {e}")
+        return
+    with entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                yield from scan_wav_files(entry.path)
+            elif entry.is_file() and entry.name.endswith('.wav'):
+                yield entry.path, entry.stat().st_size
+
+def read_wav_info(file_path):
+    """ Return (duration, sample_rate, channels) from the WAV header without reading the samples. """
+    with wave.open(file_path, 'rb') as wf:
+        sample_rate = wf.getframerate()
+        return wf.getnframes() / sample_rate, sample_rate, wf.getnchannels()
+
+def reconcile_catalog(catalog_path, main_directory):
+    """ Bring the catalog in line with the filesystem: add stray .wav files and drop missing ones. """
+    connection = open_catalog(catalog_path)
+    try:
+        known = {row[0]: row[1] for row in connection.execute('SELECT path, size FROM recordings')}
+        found = set()
+        added = 0
+        with connection:
+            for file_path, size in scan_wav_files(main_directory):
+                relative_path = relative_recording_path(main_directory, file_path)
+                found.add(relative_path)
+                if known.get(relative_path) == size:
+                    continue
+                participant_id, condition = parse_recording_filename(file_path)
+                if participant_id is None:
+                    print(f"Skipping {file_path}: file name doesn't match the recording naming scheme")
+                    continue
+                try:
+                    duration, sample_rate, channels = read_wav_info(file_path)
+                except (wave.Error, EOFError, OSError) as e:
+                    print(f"Skipping {file_path}: {e}")
+                    continue
+                connection.execute(
+                    UPSERT_RECORDING,
+                    (relative_path, participant_id, condition, duration, sample_rate, channels, size, time.time())
+                )
+                added += 1
+
+            missing = [path for path in known if path not in found]
+            connection.executemany('DELETE FROM recordings WHERE path = ?', [(path,) for path in missing])
+            # Recapp creates the catalog as soon as it registers a recording, so the file existing says
+            # nothing about whether recordings made before the catalog existed have been picked up
+            connection.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('scanned_at', ?)", (str(time.time()),))
+    finally:
+        connection.close()
+    print(f"Catalog reconciled: {added} added or updated, {len(missing)} removed")
+    return added, len(missing)
@@ -0,0 +1,130 @@
+import numpy as np
+import argparse
+import struct
+import math
+import os
+import sys
+
+# Add the parent directory to the system path to ensure module imports work correctly
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from scripts.atomic_file import atomic_write
+
+PEAKS_SUFFIX = '.peaks'
+MAGIC = b'PEAKPYR1'
+# magic, sample rate, samples per peak at level 0, total samples, number of levels
+HEADER = struct.Struct('<8sIIQI')
+# byte offset and number of (min, max) pairs for each level
+LEVEL_ENTRY = struct.Struct('<QQ')
+
+def peaks_path_for(recording_path):
+    return f'{os.path.splitext(recording_path)[0]}{PEAKS_SUFFIX}'
+
+def build_peak_levels(audio, base_block=128, min_peaks=64):
+    """ Return a list of (n, 2) int16 min/max arrays, each level decimating the previous one by two. """
+    samples = np.asarray(audio, dtype=np.float32).reshape(-1)
+    if samples.size == 0:
+        samples = np.zeros(1, dtype=np.float32)
+
+    # Level 0: one min/max pair per base_block samples, padded with the last sample so no fake peaks appear
+    padding = -samples.size % base_block
+    blocks = np.pad(samples, (0, padding), mode='edge').reshape(-1, base_block)
+    scaled = np.clip(np.stack((blocks.min(axis=1), blocks.max(axis=1)), axis=1) * 32767, -32768, 32767)
+    level = scaled.astype(np.int16)
+
+    # Higher levels come from pairs of the level below, so the audio itself is only read once
+    levels = [level]
+    while len(level) > min_peaks:
+        if len(level) % 2:
+            level = np.concatenate((level, level[-1:]))
+        pairs = level.reshape(-1, 2, 2)
+        level = np.stack((pairs[:, :, 0].min(axis=1), pairs[:, :, 1].max(axis=1)), axis=1)
+        levels.append(level)
+    return levels
+
+def write_peak_pyramid(peaks_path, audio, sr, base_block=128):
+    """ Build the min/max pyramid for a mono recording and save it as a single memory-mappable file. """
+    levels = build_peak_levels(audio, base_block)
+    offset = HEADER.size + LEVEL_ENTRY.size * len(levels)
+    entries = []
+    for level in levels:
+        entries.append(LEVEL_ENTRY.pack(offset, len(level)))
+        offset += level.nbytes
+
+    with atomic_write(peaks_path, 'wb') as file:
+        file.write(HEADER.pack(MAGIC, int(sr), base_block, len(audio), len(levels)))
+        file.write(b''.join(entries))
+        for level in levels:
+            file.write(np.ascontiguousarray(level).tobytes())
+
+class PeakPyramid:
+    """ Read-only view of a .peaks file. Each level is memory-mapped, so only the pages a query touches are read. """
+
+    def __init__(self, peaks_path):
+        with open(peaks_path, 'rb') as file:
+            magic, self.sample_rate, self.base_block, self.num_samples, num_levels = HEADER.unpack(file.read(HEADER.size))
+            if magic != MAGIC:
+                raise ValueError(f"{peaks_path} is not a peaks pyramid file")
+            entries = [LEVEL_ENTRY.unpack(file.read(LEVEL_ENTRY.size)) for _ in range(num_levels)]
+        self.levels = [np.memmap(peaks_path, dtype=np.int16, mode='r', offset=offset, shape=(count, 2))
+                       for offset, count in entries]
+
+    @property
+    def duration(self):
+        return self.num_samples / self.sample_rate
+
+    def samples_per_peak(self, level):
+        return self.base_block << level
+
+    def choose_level(self, start, end, max_points):
+        # Coarsest detail that still gives at most max_points pairs across the range
+        span = max(end - start, 0) * self.sample_rate
+        wanted = span / (self.base_block * max(max_points, 1))
+        level = math.ceil(math.log2(wanted)) if wanted > 1 else 0
+        return min(level, len(self.levels) - 1)
+
+    def read(self, start, end, max_points=2000):
+        """ Return (times, mins, maxs) covering start..end seconds with at most about max_points peaks. """
+        level = self.choose_level(start, end, max_points)
+        peaks = self.levels[level]
+        step = self.samples_per_peak(level)
+        first = max(int(start * self.sample_rate) // step, 0)
+        last = min(int(math.ceil(end * self.sample_rate / step)), len(peaks))
+        window = np.array(peaks[first:last], dtype=np.float32) / 32767
+        times = (np.arange(first, first + len(window)) + 0.5) * step / self.sample_rate
+        return times, window[:, 0], window[:, 1]
+
+def view_peaks(peaks_path, max_points=2000):
+    """ Interactive waveform browser: every pan or zoom re-reads just the visible range at a matching level. """
+    import matplotlib.pyplot as plt
+
+    pyramid = PeakPyramid(peaks_path)
+    figure, axes = plt.subplots(figsize=(14, 6))
+    state = {'envelope': None, 'busy': False}
+
+    def redraw(ax):
+        if state['busy']:
+            return
+        state['busy'] = True
+        start, end = ax.get_xlim()
+        times, mins, maxs = pyramid.read(max(start, 0), min(end, pyramid.duration), max_points)
+        if state['envelope'] is not None:
+            state['envelope'].remove()
+        state['envelope'] = ax.fill_between(times, mins, maxs, color='tab:blue', linewidth=0)
+        figure.canvas.draw_idle()
+        state['busy'] = False
+
+    axes.set_xlim(0, pyramid.duration)
+    axes.set_ylim(-1, 1)
+    axes.set_xlabel('Time (s)')
+    axes.set_ylabel('Amplitude')
+    axes.set_title(os.path.basename(peaks_path))
+    axes.callbacks.connect('xlim_changed', redraw)
+    redraw(axes)
+    plt.show()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Browse a recording's .peaks file; zoom and pan with the toolbar.")
+    parser.add_argument('peaks_file', help="A .peaks file written by wavstomp.py next to the recording")
+    parser.add_argument('--max-points', type=int, default=2000, help="Peaks drawn across the visible range")
+    args = parser.parse_args()
+    view_peaks(args.peaks_file, args.max_points)
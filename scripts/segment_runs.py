@@ -0,0 +1,84 @@
+import tempfile
+import hashlib
+import heapq
+import csv
+import os
+import sys
+
+# Add the parent directory to the system path to ensure module imports work correctly
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from scripts.atomic_file import atomic_write
+
+RUN_SUFFIX = '.run.csv'
+
+# Keep the number of run files open at once well below typical file descriptor limits
+MAX_MERGE_FAN_IN = 64
+
+def segment_sort_key(row):
+    # Participant ID, Condition, then the numeric part of the 'E<number>' Event ID
+    return row[0], row[1], int(row[2][1:])
+
+def recording_digest(relative_path):
+    # Keyed on the catalog's relative path so every host names a recording's run the same way
+    return hashlib.sha1(relative_path.encode('utf-8')).hexdigest()[:16]
+
+def question_times_digest(question_times):
+    # Identifies the flags a run was computed from, so only a recording whose own flags changed is redone
+    return hashlib.sha1(','.join(repr(float(time)) for time in question_times).encode('utf-8')).hexdigest()[:16]
+
+def run_path_for(run_directory, relative_path, question_times):
+    """ Stable run file name for a recording and its question times, so a restarted job can tell which files are done. """
+    return os.path.join(run_directory, f'{recording_digest(relative_path)}-{question_times_digest(question_times)}{RUN_SUFFIX}')
+
+def write_segment_run(run_path, rows):
+    """ Sort one recording's formatted rows and write them durably to their own run file. """
+    rows = sorted(rows, key=segment_sort_key)
+    # The run only appears under its name once it is complete, so --resume never trusts a partial one
+    with atomic_write(run_path, newline='') as file:
+        csv.writer(file).writerows(rows)
+
+def list_segment_runs(run_directory):
+    if not os.path.isdir(run_directory):
+        return []
+    return sorted(entry.path for entry in os.scandir(run_directory) if entry.name.endswith(RUN_SUFFIX))
+
+def clear_segment_runs(run_directory):
+    for run_path in list_segment_runs(run_directory):
+        os.remove(run_path)
+
+def merge_into(run_paths, writer):
+    files = [open(run_path, 'r', newline='') for run_path in run_paths]
+    try:
+        writer.writerows(heapq.merge(*(csv.reader(file) for file in files), key=segment_sort_key))
+    finally:
+        for file in files:
+            file.close()
+
+def merge_segment_runs(run_paths, output_csv, header, fan_in=MAX_MERGE_FAN_IN):
+    """ k-way merge sorted run files into output_csv, holding one row per open run in memory. """
+    # Each pass must at least halve the number of runs, or the passes below would never finish
+    if fan_in < 2:
+        raise ValueError(f"fan_in must be at least 2, got {fan_in}")
+    run_paths = list(run_paths)
+    output_directory = os.path.dirname(output_csv) or '.'
+    intermediates = []
+    try:
+        # Collapse the runs in passes until a single merge can open all of them
+        while len(run_paths) > fan_in:
+            merged_paths = []
+            for group_start in range(0, len(run_paths), fan_in):
+                # Unique names, so concurrent merges into the same directory can't clobber each other's passes
+                handle, merged_path = tempfile.mkstemp(prefix='.merge_', suffix=RUN_SUFFIX, dir=output_directory)
+                intermediates.append(merged_path)
+                with os.fdopen(handle, 'w', newline='') as file:
+                    merge_into(run_paths[group_start:group_start + fan_in], csv.writer(file))
+                merged_paths.append(merged_path)
+            run_paths = merged_paths
+
+        with atomic_write(output_csv, newline='') as file:
+            writer = csv.writer(file)
+            writer.writerow(header)
+            merge_into(run_paths, writer)
+    finally:
+        for merged_path in intermediates:
+            os.remove(merged_path)
@@ -3,76 +3,119 @@ import numpy as np
 import matplotlib.pyplot as plt
 import csv
 import os
+import sys
+import argparse
+import bisect
+import time
 import webrtcvad
 
-def load_question_flags(flag_csv_file, participant_id, condition):
-    question_times = []
+# Add the parent directory to the system path to ensure module imports work correctly
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from scripts.catalog import CATALOG_FILENAME, is_catalog_scanned, list_recordings, reconcile_catalog, resolve_recording_path
+from scripts.segment_runs import clear_segment_runs, merge_segment_runs, recording_digest, run_path_for, write_segment_run
+from scripts.work_queue import WorkQueue, default_worker_id
+from scripts.peak_pyramid import peaks_path_for, write_peak_pyramid
+
+def load_question_flags(flag_csv_file):
+    """ Read the flag CSV once and return question times keyed by (participant ID, condition). """
+    question_flags = {}
     with open(flag_csv_file, 'r') as file:
         reader = csv.DictReader(file)
         for row in reader:
-            if row['Participant ID'] == participant_id and row['Condition'] == condition:
-                question_times.append(float(row['Question Timestamp (s)']))
-    return question_times
+            key = (row['Participant ID'], row['Condition'])
+            question_flags.setdefault(key, []).append(float(row['Question Timestamp (s)']))
+    return question_flags
 
-def vad_detect_speech(audio, sr, frame_duration=30):
+def recording_question_times(question_flags, recording):
+    return question_flags.get((recording['participant_id'], recording['condition']), [])
+
+# Channel layout written by Recapp: the participant mic is always channel 0, and dual-channel
+# recordings carry the interviewer (second mic or prompt playback loopback) on channel 1
+PARTICIPANT_CHANNEL = 0
+INTERVIEWER_CHANNEL = 1
+
+def frame_channels(audio_int16, frame_size):
+    """ View a (channels, samples) array as (channels, frames, frame_size) without copying. """
+    num_frames = audio_int16.shape[-1] // frame_size
+    return audio_int16[:, :num_frames * frame_size].reshape(audio_int16.shape[0], num_frames, frame_size)
+
+def vad_frames(frames, sr, frame_size):
+    """ Run webrtcvad over one channel's frames and return speech (start, end) times in seconds. """
     vad = webrtcvad.Vad()
     vad.set_mode(0)  # 0: most aggressive, 3: least aggressive
-    
-    # Resample the audio to 16000 Hz if necessary
+
+    is_speech = np.zeros(len(frames), dtype=bool)
+    for index, frame in enumerate(frames):
+        try:
+            is_speech[index] = vad.is_speech(frame.tobytes(), sr)
+        except ValueError as e:
+            print(f"Error processing frame {index * frame_size}-{(index + 1) * frame_size}: {e}")
+
+    # Runs of speech frames become segments: +1 edges are starts, -1 edges are ends
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], is_speech.astype(np.int8), [0]))))
+    starts, ends = edges[0::2], edges[1::2]
+    return [(int(start) * frame_size / sr, int(end) * frame_size / sr) for start, end in zip(starts, ends)]
+
+def vad_detect_speech_channels(audio, sr, frame_duration=30):
+    """ Detect speech in every channel of a (channels, samples) array. """
+    audio = np.atleast_2d(audio)
+
+    # Resample the audio to 16000 Hz if necessary (all channels at once)
     if sr != 16000:
         print(f"Resampling audio from {sr} Hz to 16000 Hz")
         audio = librosa.resample(audio, orig_sr=sr, target_sr=16000)
         sr = 16000
-    
+
     # Convert audio to 16-bit PCM format
     audio_int16 = (audio * 32767).astype(np.int16)
-    
+
     # Calculate frame size in samples
     frame_size = int(sr * frame_duration / 1000)
-    
-    speech_segments = []
-    current_start = None
-    current_end = None
+    channel_frames = frame_channels(audio_int16, frame_size)
 
-    print("Running VAD on audio frames...")
-    for start in range(0, len(audio_int16) - frame_size, frame_size):
-        end = start + frame_size
-        try:
-            is_speech = vad.is_speech(audio_int16[start:end].tobytes(), sr)
-        except ValueError as e:
-            print(f"Error processing frame {start}-{end}: {e}")
-            continue
-        
-        if is_speech:
-            if current_start is None:
-                current_start = start
-            current_end = end
-        else:
-            if current_start is not None:
-                speech_segments.append((current_start, current_end))
-                current_start = None
-    
-    if current_start is not None:
-        speech_segments.append((current_start, current_end))
+    # webrtcvad holds the GIL and each frame takes microseconds, so threads would only add overhead
+    print(f"Running VAD on audio frames ({len(channel_frames)} channel(s))...")
+    channel_segments = [vad_frames(frames, sr, frame_size) for frames in channel_frames]
+
+    for channel, speech_segments in enumerate(channel_segments):
+        print(f"Detected {len(speech_segments)} speech segments on channel {channel}")
+    return channel_segments
+
+def vad_detect_speech(audio, sr, frame_duration=30):
+    return vad_detect_speech_channels(audio, sr, frame_duration)[0]
 
-    print(f"Detected {len(speech_segments)} speech segments")
-    return [(start / sr, end / sr) for start, end in speech_segments]
+def within_interviewer_speech(start, end, interviewer_starts, interviewer_segments):
+    # Treat a participant-channel segment as bleed if the interviewer was talking for all of it.
+    # VAD segments are sorted and disjoint, so only the last one starting at or before start can contain it
+    index = bisect.bisect_right(interviewer_starts, start) - 1
+    return index >= 0 and end <= interviewer_segments[index][1]
 
-def analyze_audio_with_vad(file_path, question_times):
-    audio, sr = librosa.load(file_path, sr=None)
+def analyze_audio_with_vad(file_path, question_times, participant_channel=PARTICIPANT_CHANNEL, interviewer_channel=INTERVIEWER_CHANNEL):
+    # Decode every channel in a single pass; mono files come back as a 1-D array
+    audio, sr = librosa.load(file_path, sr=None, mono=False)
+    audio = np.atleast_2d(audio)
     segments = []
 
+    # VAD runs once per channel for the whole file, not once per question
+    channel_segments = vad_detect_speech_channels(audio, sr)
+    interviewer_segments = channel_segments[interviewer_channel] if interviewer_channel < len(channel_segments) else []
+    interviewer_starts = [start for start, end in interviewer_segments]
+
+    # Drop interviewer bleed once up front rather than re-checking candidates for every question
+    answer_candidates = [(start, end) for start, end in channel_segments[participant_channel]
+                         if not within_interviewer_speech(start, end, interviewer_starts, interviewer_segments)]
+    answer_starts = [start for start, end in answer_candidates]
+
     for question_time in question_times:
         segments.append(('Question', question_time, question_time))
-        
-        # Detect speech after the question timestamp
-        vad_segments = vad_detect_speech(audio, sr)
-        for start, end in vad_segments:
-            if start > question_time:
-                segments.append(('Answer', start, end))
-                break  # Assume only the first segment after the question is the answer
-    
-    return segments, audio, sr
+
+        # Detect participant speech after the question timestamp
+        # Assume only the first segment after the question is the answer
+        index = bisect.bisect_right(answer_starts, question_time)
+        if index < len(answer_candidates):
+            segments.append(('Answer', *answer_candidates[index]))
+
+    return segments, audio[participant_channel], sr
 
 def save_segments_to_csv(csv_file, segments, participant_id, condition):
     event_id = 1  # Start event ID
@@ -106,69 +149,205 @@ def plot_segments(segments, audio, sr, plot_file):
     plt.savefig(plot_file)
     plt.close()  # Close the plot to save memory
 
-def extract_info_from_filename(filename):
-    base_name = os.path.basename(filename)
-    parts = base_name.split('_')
-    participant_id = parts[1]
-    condition = parts[2][1]  # Take the second character after the underscore
-    return participant_id, condition
+SEGMENT_HEADER = ['Participant ID', 'Condition', 'Event ID', 'Question Timestamp (s)', 'Answer Timestamp (s)', 'Time Difference (s)']
+
+def process_recording(recording, question_times):
+    """ Analyse one catalogued recording, save its plot and return its formatted CSV rows. """
+    file_path = recording['path']
+    participant_id = recording['participant_id']
+    condition = recording['condition']
+    root, filename = os.path.split(file_path)
+
+    # Analyze the audio and detect segments using VAD
+    segments, audio, sr = analyze_audio_with_vad(file_path, question_times)
 
-def process_directory(main_directory, flag_csv, output_csv):
+    rows = []
+    event_id = 1
+    for segment_type, start, end in segments:
+        if segment_type == 'Question':
+            question_time = start
+        elif segment_type == 'Answer' and question_time is not None:
+            time_difference = end - question_time
+            rows.append([participant_id, condition, f'E{event_id}', f'{question_time:.2f}', f'{end:.2f}', f'{time_difference:.2f}'])
+            event_id += 1
+
+    # Generate and save the plot
+    plot_file = os.path.join(root, f'{os.path.splitext(filename)[0]}.png')
+    plot_segments(segments, audio, sr, plot_file)
+
+    # Save a zoomable peaks pyramid alongside the static plot (browse with peak_pyramid.py)
+    peaks_file = peaks_path_for(file_path)
+    write_peak_pyramid(peaks_file, audio, sr)
+    print(f"Processed {filename}, saved plot to {plot_file} and peaks to {peaks_file}")
+    return rows
+
+def load_recordings(main_directory, data_directory, catalog_path=None, reconcile=False):
+    # Enumerate work from the recording catalog; only walk the filesystem when asked to
+    # (or until the first scan has run, to pick up the participants/ tree recorded before the catalog existed)
+    if catalog_path is None:
+        catalog_path = os.path.join(data_directory, CATALOG_FILENAME)
+    if reconcile or not is_catalog_scanned(catalog_path):
+        reconcile_catalog(catalog_path, main_directory)
+    return list_recordings(catalog_path, main_directory)
+
+def prepare_run_directory(data_directory, resume=False):
+    # Each recording's sorted rows are spilled to their own run file as soon as it is processed,
+    # so memory stays bounded and an interrupted job can pick up where it left off with resume=True
+    run_directory = os.path.join(data_directory, 'segment_runs')
+    os.makedirs(run_directory, exist_ok=True)
+    if not resume:
+        clear_segment_runs(run_directory)
+    return run_directory
+
+def catalog_run_paths(run_directory, recordings, question_flags):
+    # Only runs for recordings still in the catalog, made from their current question times, belong in
+    # the output; leftovers from removed recordings or edited flags are ignored
+    run_paths = (run_path_for(run_directory, recording['relative_path'], recording_question_times(question_flags, recording))
+                 for recording in recordings)
+    return [run_path for run_path in run_paths if os.path.exists(run_path)]
+
+def process_directory(main_directory, flag_csv, output_csv, catalog_path=None, reconcile=False, resume=False):
     # Ensure the data directory exists
     data_directory = os.path.dirname(output_csv)
     if not os.path.exists(data_directory):
         os.makedirs(data_directory)
 
-    # Prepare the CSV file with a header
-    with open(output_csv, 'w', newline='') as file:
-        writer = csv.writer(file)
-        writer.writerow(['Participant ID', 'Condition', 'Event ID', 'Question Timestamp (s)', 'Answer Timestamp (s)', 'Time Difference (s)'])
-    
-    all_segments = []
-
-    # Recursively walk through the directory
-    for root, dirs, files in os.walk(main_directory):
-        for filename in files:
-            if filename.endswith('.wav'):
-                file_path = os.path.join(root, filename)
-                participant_id, condition = extract_info_from_filename(filename)
-                
-                # Load the question times from the flag CSV file
-                question_times = load_question_flags(flag_csv, participant_id, condition)
-                
-                # Analyze the audio and detect segments using VAD
-                segments, audio, sr = analyze_audio_with_vad(file_path, question_times)
-                
-                # Prepare the segments for sorting
-                event_id = 1
-                for segment_type, start, end in segments:
-                    if segment_type == 'Question':
-                        question_time = start
-                    elif segment_type == 'Answer' and question_time is not None:
-                        time_difference = end - question_time
-                        all_segments.append([participant_id, condition, f'E{event_id}', question_time, end, time_difference])
-                        event_id += 1
-
-                # Generate and save the plot
-                plot_file = os.path.join(root, f'{os.path.splitext(filename)[0]}.png')
-                plot_segments(segments, audio, sr, plot_file)
-                print(f"Processed {filename}, saved plot to {plot_file}")
-    
-    # Sort all segments by Participant ID, Condition, and Event ID
-    all_segments.sort(key=lambda x: (x[0], x[1], int(x[2][1:])))  # Assuming Event ID format is 'E<number>'
-    
-    # Write sorted segments to the CSV
-    with open(output_csv, 'a', newline='') as file:
-        writer = csv.writer(file)
-        for segment in all_segments:
-            writer.writerow([segment[0], segment[1], segment[2], f'{segment[3]:.2f}', f'{segment[4]:.2f}', f'{segment[5]:.2f}'])
+    recordings = load_recordings(main_directory, data_directory, catalog_path, reconcile)
+    run_directory = prepare_run_directory(data_directory, resume)
+    question_flags = load_question_flags(flag_csv)
+
+    for recording in recordings:
+        file_path = recording['path']
+        question_times = recording_question_times(question_flags, recording)
+        run_path = run_path_for(run_directory, recording['relative_path'], question_times)
+        if resume and os.path.exists(run_path):
+            continue
+        if not os.path.exists(file_path):
+            print(f"Skipping {file_path}: file is catalogued but missing (run with --reconcile)")
+            continue
+        write_segment_run(run_path, process_recording(recording, question_times))
+
+    # Merge the runs by Participant ID, Condition and Event ID into the final CSV
+    merge_segment_runs(catalog_run_paths(run_directory, recordings, question_flags), output_csv, SEGMENT_HEADER)
+
+def run_coordinator(main_directory, flag_csv, output_csv, queue_directory, catalog_path=None, reconcile=False, resume=False,
+                    lease_timeout=120, poll_interval=5):
+    """ Fill the shared work queue, wait for workers to drain it, then merge their results.
+
+    Returns False, without merging, if any recording failed on its worker.
+    """
+    data_directory = os.path.dirname(output_csv)
+    os.makedirs(data_directory, exist_ok=True)
+
+    recordings = load_recordings(main_directory, data_directory, catalog_path, reconcile)
+    run_directory = prepare_run_directory(data_directory, resume)
+
+    question_flags = load_question_flags(flag_csv)
+
+    queue = WorkQueue(queue_directory, lease_timeout=lease_timeout)
+    queue.reset()
+    for recording in recordings:
+        question_times = recording_question_times(question_flags, recording)
+        if resume and os.path.exists(run_path_for(run_directory, recording['relative_path'], question_times)):
+            continue
+        # Payloads carry only the relative path; each worker resolves it against its own mount of participants/.
+        # The question times travel with the task so workers name their runs from the same flags the merge uses
+        payload = {key: value for key, value in recording.items() if key != 'path'}
+        payload['question_times'] = question_times
+        queue.enqueue(recording_digest(recording['relative_path']), payload)
+    queue.mark_ready()
+
+    while True:
+        queue.requeue_expired()
+        pending, leased, done, failed = queue.counts()
+        if pending == 0 and leased == 0:
+            break
+        print(f"Waiting for workers: {pending} pending, {leased} in progress, {done} done, {failed} failed")
+        time.sleep(poll_interval)
+
+    # A partial main_segments.csv would look complete, so leave the previous one in place instead
+    failures = queue.failures()
+    if failures:
+        for failure in failures:
+            print(f"Failed: {failure['relative_path']}: {failure['error']}")
+        print(f"{len(failures)} recordings failed; fix them and rerun with --resume to merge the results")
+        return False
+
+    merge_segment_runs(catalog_run_paths(run_directory, recordings, question_flags), output_csv, SEGMENT_HEADER)
+    return True
+
+def run_worker(main_directory, output_csv, queue_directory, worker_id=None, lease_timeout=120, poll_interval=5):
+    """ Claim recordings from the shared work queue until it is drained, writing one run file per recording. """
+    worker_id = worker_id or default_worker_id()
+    run_directory = os.path.join(os.path.dirname(output_csv), 'segment_runs')
+    os.makedirs(run_directory, exist_ok=True)
+    queue = WorkQueue(queue_directory, lease_timeout=lease_timeout)
+
+    while not queue.is_ready():
+        print(f"Worker {worker_id} waiting for the coordinator to fill the queue...")
+        time.sleep(poll_interval)
+
+    processed = 0
+    while True:
+        # Workers also reclaim leases from crashed peers so progress doesn't depend on the coordinator
+        queue.requeue_expired()
+        lease = queue.claim(worker_id)
+        if lease is None:
+            pending, leased, done, failed = queue.counts()
+            if pending == 0 and leased == 0:
+                break
+            time.sleep(poll_interval)
+            continue
+
+        recording = dict(lease.payload, path=resolve_recording_path(main_directory, lease.payload['relative_path']))
+        error = None
+        with lease:
+            if not os.path.exists(recording['path']):
+                print(f"Skipping {recording['path']}: file is catalogued but missing (run with --reconcile)")
+            else:
+                # Run files are named per recording, so a task processed twice after a lost lease is harmless
+                try:
+                    question_times = recording['question_times']
+                    run_path = run_path_for(run_directory, recording['relative_path'], question_times)
+                    write_segment_run(run_path, process_recording(recording, question_times))
+                except Exception as e:
+                    # Don't hand a file that fails every time back to the queue for the other workers to trip over
+                    print(f"Error processing {recording['path']}: {e}")
+                    error = e
+        if error is not None:
+            finished = lease.fail(error)
+        else:
+            finished = lease.complete()
+            if finished:
+                processed += 1
+        if not finished:
+            print(f"Worker {worker_id} lost its lease on {recording['path']}; another worker will redo it")
+
+    print(f"Worker {worker_id} finished after processing {processed} recordings")
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Detect question/answer segments in Recapp recordings.")
+    parser.add_argument('--reconcile', action='store_true', help="Rescan the participants directory for recordings missing from the catalog")
+    parser.add_argument('--resume', action='store_true', help="Keep results from an interrupted run and only process the remaining recordings")
+    parser.add_argument('--coordinator', action='store_true', help="Queue all recordings in the shared work queue for --worker processes, then merge their results")
+    parser.add_argument('--worker', action='store_true', help="Process recordings claimed from the shared work queue")
+    parser.add_argument('--queue', default=os.path.abspath(os.path.join('..', 'data', 'queue')), help="Shared work queue directory (must be on a filesystem every node can see)")
+    parser.add_argument('--worker-id', help="Name for this worker in lease files (default: <hostname>-<pid>)")
+    parser.add_argument('--lease-timeout', type=float, default=120, help="Seconds without a heartbeat before a claimed recording is re-queued (workers heartbeat every quarter of this)")
+    args = parser.parse_args()
+
     # Calculate the absolute path to the main directory
     main_directory = os.path.abspath(os.path.join('..', 'participants'))  # Move up one directory level to reach the participants directory
     flag_csv = os.path.abspath(os.path.join('..', 'data', 'flagged_events.csv'))  # Path to the CSV file with question flags
     output_csv = os.path.abspath(os.path.join('..', 'data', 'main_segments.csv'))  # Save the main_segments.csv in the data subdirectory
     
-    # Process all WAV files in the main directory and its subdirectories
-    process_directory(main_directory, flag_csv, output_csv)
+    if args.coordinator:
+        if not run_coordinator(main_directory, flag_csv, output_csv, args.queue, reconcile=args.reconcile, resume=args.resume,
+                               lease_timeout=args.lease_timeout):
+            sys.exit(1)
+    elif args.worker:
+        run_worker(main_directory, output_csv, args.queue, worker_id=args.worker_id, lease_timeout=args.lease_timeout)
+    else:
+        # Process all WAV files in the main directory and its subdirectories
+        process_directory(main_directory, flag_csv, output_csv, reconcile=args.reconcile, resume=args.resume)
     print("Processing complete.")
@@ -0,0 +1,182 @@
+import threading
+import socket
+import json
+import time
+import os
+
+TASK_SUFFIX = '.task'
+READY_MARKER = 'ready'
+
+def default_worker_id():
+    return f'{socket.gethostname()}-{os.getpid()}'
+
+class Lease:
+    """ A claimed task. Use as a context manager to keep the lease alive with heartbeats while working. """
+
+    def __init__(self, queue, task_id, path, payload, heartbeat_interval):
+        self.queue = queue
+        self.task_id = task_id
+        self.path = path
+        self.payload = payload
+        self.heartbeat_interval = heartbeat_interval
+        self.lost = False
+        self.stopped = threading.Event()
+        self.heartbeat_thread = None
+
+    def heartbeat(self):
+        try:
+            os.utime(self.path)
+        except FileNotFoundError:
+            # Another node decided the lease had expired and re-queued the task
+            self.lost = True
+
+    def heartbeat_loop(self):
+        while not self.stopped.wait(self.heartbeat_interval):
+            self.heartbeat()
+
+    def __enter__(self):
+        self.heartbeat_thread = threading.Thread(target=self.heartbeat_loop, daemon=True)
+        self.heartbeat_thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stopped.set()
+        self.heartbeat_thread.join()
+        if exc_type is not None:
+            # Hand the task straight back rather than waiting for the lease to expire
+            self.queue.release(self)
+        return False
+
+    def complete(self):
+        return self.finish(self.queue.done_directory)
+
+    def fail(self, error):
+        """ Park the task in failed/ with the error, so it isn't retried and the coordinator can report it. """
+        if not self.finish(self.queue.failed_directory):
+            return False
+        failed_path = os.path.join(self.queue.failed_directory, f'{self.task_id}{TASK_SUFFIX}')
+        temp_path = os.path.join(self.queue.failed_directory, f'{self.task_id}.tmp')
+        with open(temp_path, 'w') as file:
+            json.dump(dict(self.payload, error=str(error)), file)
+        os.replace(temp_path, failed_path)
+        return True
+
+    def finish(self, directory):
+        try:
+            os.replace(self.path, os.path.join(directory, f'{self.task_id}{TASK_SUFFIX}'))
+            return True
+        except FileNotFoundError:
+            self.lost = True
+            return False
+
+class WorkQueue:
+    """ Task queue kept entirely in a shared directory, usable from several processes or machines.
+
+    Tasks move between pending/, leased/, done/ and failed/ by rename, which is atomic on a single
+    filesystem, so exactly one worker wins each claim. A leased task's mtime is its heartbeat;
+    tasks whose heartbeat is older than lease_timeout are moved back to pending/. Node clocks
+    are assumed to agree to well within lease_timeout.
+    """
+
+    def __init__(self, queue_directory, lease_timeout=120, heartbeat_interval=None):
+        # Several heartbeats must fit inside one lease, or every lease would expire before it is renewed
+        if heartbeat_interval is None:
+            heartbeat_interval = lease_timeout / 4
+        if heartbeat_interval >= lease_timeout:
+            raise ValueError(f"heartbeat_interval ({heartbeat_interval}s) must be shorter than lease_timeout ({lease_timeout}s)")
+        self.queue_directory = queue_directory
+        self.pending_directory = os.path.join(queue_directory, 'pending')
+        self.leased_directory = os.path.join(queue_directory, 'leased')
+        self.done_directory = os.path.join(queue_directory, 'done')
+        self.failed_directory = os.path.join(queue_directory, 'failed')
+        self.lease_timeout = lease_timeout
+        self.heartbeat_interval = heartbeat_interval
+        for directory in self.task_directories():
+            os.makedirs(directory, exist_ok=True)
+
+    def task_directories(self):
+        return self.pending_directory, self.leased_directory, self.done_directory, self.failed_directory
+
+    def reset(self):
+        """ Empty the queue. Only the coordinator should call this, before any workers start. """
+        ready_path = os.path.join(self.queue_directory, READY_MARKER)
+        if os.path.exists(ready_path):
+            os.remove(ready_path)
+        for directory in self.task_directories():
+            for entry in os.scandir(directory):
+                os.remove(entry.path)
+
+    def enqueue(self, task_id, payload):
+        temp_path = os.path.join(self.pending_directory, f'{task_id}.tmp')
+        with open(temp_path, 'w') as file:
+            json.dump(payload, file)
+        os.replace(temp_path, os.path.join(self.pending_directory, f'{task_id}{TASK_SUFFIX}'))
+
+    def mark_ready(self):
+        open(os.path.join(self.queue_directory, READY_MARKER), 'w').close()
+
+    def is_ready(self):
+        return os.path.exists(os.path.join(self.queue_directory, READY_MARKER))
+
+    def claim(self, worker_id):
+        """ Atomically take one pending task, or return None if there is nothing to claim. """
+        for entry in os.scandir(self.pending_directory):
+            if not entry.name.endswith(TASK_SUFFIX):
+                continue
+            task_id = entry.name[:-len(TASK_SUFFIX)]
+            leased_path = os.path.join(self.leased_directory, f'{task_id}@{worker_id}{TASK_SUFFIX}')
+            try:
+                # rename keeps the mtime, so stamp the task first; otherwise a task that waited longer than
+                # lease_timeout would look expired the moment it lands in leased/
+                os.utime(entry.path)
+                os.rename(entry.path, leased_path)
+            except FileNotFoundError:
+                continue  # Another worker got there first
+            try:
+                os.utime(leased_path)
+                with open(leased_path, 'r') as file:
+                    payload = json.load(file)
+            except FileNotFoundError:
+                continue  # Re-queued by a peer before we could read it; treat the claim as lost
+            return Lease(self, task_id, leased_path, payload, self.heartbeat_interval)
+        return None
+
+    def release(self, lease):
+        try:
+            os.replace(lease.path, os.path.join(self.pending_directory, f'{lease.task_id}{TASK_SUFFIX}'))
+        except FileNotFoundError:
+            pass
+
+    def requeue_expired(self):
+        """ Move tasks whose worker has stopped heartbeating back to pending/. """
+        requeued = 0
+        now = time.time()
+        for entry in os.scandir(self.leased_directory):
+            if not entry.name.endswith(TASK_SUFFIX):
+                continue
+            try:
+                if now - entry.stat().st_mtime <= self.lease_timeout:
+                    continue
+                task_id = entry.name[:-len(TASK_SUFFIX)].split('@', 1)[0]
+                os.rename(entry.path, os.path.join(self.pending_directory, f'{task_id}{TASK_SUFFIX}'))
+            except FileNotFoundError:
+                continue  # Completed or re-queued by someone else in the meantime
+            print(f"Lease on task {task_id} expired, re-queued")
+            requeued += 1
+        return requeued
+
+    def counts(self):
+        """ Return (pending, leased, done, failed) task counts. """
+        def count(directory):
+            return sum(1 for entry in os.scandir(directory) if entry.name.endswith(TASK_SUFFIX))
+        return tuple(count(directory) for directory in self.task_directories())
+
+    def failures(self):
+        """ Return the payloads of failed tasks, each with the 'error' its worker recorded. """
+        failures = []
+        for entry in sorted(os.scandir(self.failed_directory), key=lambda entry: entry.name):
+            if not entry.name.endswith(TASK_SUFFIX):
+                continue
+            with open(entry.path, 'r') as file:
+                failures.append(json.load(file))
+        return failures